@@ -1,22 +1,28 @@
 import os
+import hashlib
 import uvicorn
 import asyncio
-import tempfile
 import logging
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from fastapi import Depends, FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import StreamingResponse
+from fastapi.sse import EventSourceResponse, ServerSentEvent
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
-from PyPDF2 import PdfReader
 
 # --- LangChain Imports ---
 from langchain_core.documents import Document
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_pinecone import PineconeVectorStore
+from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # --- Jarvis Core ---
-from rag_core.chat_pipeline import get_jarvis_chain, _combine_documents
+from rag_core.chat_pipeline import (
+    get_jarvis_chain, get_embeddings, get_vectorstore, get_semantic_cache, invalidate_retrieval_cache,
+    STORE, _combine_documents
+)
+from rag_core.pdf_text import extract_pdf_text
 
 # --- Load Environment Variables ---
 from dotenv import load_dotenv
@@ -26,11 +32,42 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("jarvis_backend")
 
-PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
-BGE_MODEL_NAME = os.getenv("BGE_MODEL_NAME", "BAAI/bge-small-en-v1.5")
+WARMUP = os.getenv("WARMUP", "1") == "1"
+WARMUP_SESSION_ID = "_warmup"
+
+UPLOAD_CHUNK_SIZE = 800
+UPLOAD_CHUNK_OVERLAP = 100
+# Token streams must bypass GZip (and any proxy buffering) or tokens arrive in bursts.
+STREAM_HEADERS = {"Content-Encoding": "identity", "X-Accel-Buffering": "no"}
+LLM_POOL_WORKERS = 16
+INGEST_POOL_WORKERS = 4
+UPLOAD_READ_CHUNK = 1 << 20  # 1 MiB
 
 jarvis_chain = None
 
+text_splitter = RecursiveCharacterTextSplitter(
+    chunk_size=UPLOAD_CHUNK_SIZE, chunk_overlap=UPLOAD_CHUNK_OVERLAP
+)
+
+# In-flight uploads keyed by content hash: identical concurrent uploads ingest once.
+_inflight_uploads: dict[str, asyncio.Task] = {}
+
+
+# --- Warm-up ---
+def _warmup(app: FastAPI):
+    """
+    Runs one throwaway query so the first real request doesn't pay for
+    model page-in, tokenizer init, Pinecone TLS and the Ollama client pool.
+    """
+    if app.state.embeddings:
+        app.state.embeddings.embed_query("warmup")
+    if jarvis_chain:
+        config = {"configurable": {"session_id": WARMUP_SESSION_ID}}
+        for _ in jarvis_chain.stream({"input": "warmup"}, config=config):
+            pass
+        STORE.pop(WARMUP_SESSION_ID, None)
+        get_semantic_cache().clear()  # don't serve the throwaway answer to anyone
+
 
 # --- Lifespan Manager ---
 @asynccontextmanager
@@ -38,19 +75,48 @@ async def lifespan(app: FastAPI):
     """Handles startup and shutdown lifecycle for the Jarvis backend."""
     global jarvis_chain
 
-    print("\n--- Jarvis Backend Startup ---")
+    logger.info("--- Jarvis Backend Startup ---")
+    # Separate pools so slow uploads cannot starve the chat path (and vice versa).
+    app.state.llm_pool = ThreadPoolExecutor(max_workers=LLM_POOL_WORKERS, thread_name_prefix="llm")
+    app.state.ingest_pool = ThreadPoolExecutor(max_workers=INGEST_POOL_WORKERS, thread_name_prefix="ingest")
+    # PDF parsing is CPU-bound; run it in worker processes, off the event loop.
+    # Spawned, not forked: this process already runs torch, httpx and thread pools.
+    app.state.pdf_pool = ProcessPoolExecutor(
+        max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+    )
+
     try:
         jarvis_chain = get_jarvis_chain()
-        print("✅ RAG Chain (LLM + Pinecone) initialized successfully.")
+        logger.info("✅ RAG Chain (LLM + Pinecone) initialized successfully.")
     except Exception as e:
-        logger.error(f"❌ FATAL ERROR: Could not initialize Jarvis RAG chain: {e}")
+        logger.error("❌ FATAL ERROR: Could not initialize Jarvis RAG chain: %s", e)
         jarvis_chain = None
 
-    yield  # Keeps FastAPI running
+    # Shared by uploads; same instances the chain uses.
+    app.state.embeddings = None
+    app.state.vectorstore = None
+    try:
+        app.state.embeddings = get_embeddings()
+        app.state.vectorstore = get_vectorstore()
+    except Exception as e:
+        logger.error("❌ Could not initialize upload vectorstore: %s", e)
+
+    if WARMUP:
+        try:
+            await asyncio.get_running_loop().run_in_executor(app.state.llm_pool, _warmup, app)
+            logger.info("🔥 Warm-up query completed.")
+        except Exception as e:
+            logger.warning("⚠️ Warm-up failed (continuing cold): %s", e)
 
-    # --- Shutdown logic ---
-    print("\n--- Jarvis Backend Shutdown ---")
-    print("✅ All resources released gracefully.")
+    try:
+        yield  # Keeps FastAPI running
+    finally:
+        # --- Shutdown logic ---
+        logger.info("--- Jarvis Backend Shutdown ---")
+        app.state.llm_pool.shutdown(wait=False, cancel_futures=True)
+        app.state.ingest_pool.shutdown(wait=False, cancel_futures=True)
+        app.state.pdf_pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("✅ All resources released gracefully.")
 
 
 # --- Initialize FastAPI ---
@@ -64,94 +130,215 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 
 # --- Schema for Frontend Input ---
 class ChatRequest(BaseModel):
     input: str
     session_id: str = "default_user"
+    sources: list[str] | None = None  # restrict retrieval to these document sources
 
 
 # --- Streaming Function ---
+def _answer_text(chunk: dict) -> str:
+    return chunk.get("answer", "")
+
+
+def _content_text(chunk) -> str:
+    return str(chunk.content)
+
+
+def _select_extractor(chunk):
+    """
+    Picks the text extractor for a chain's chunk type (str / dict / message).
+    A chain emits one chunk type, so this runs once per stream instead of per token.
+    """
+    if isinstance(chunk, str):
+        return str
+    if isinstance(chunk, dict):
+        return _answer_text
+    if hasattr(chunk, "content"):
+        return _content_text
+    return str
+
+
+async def _aiter(sync_iterable, loop, executor):
+    """Drives a sync iterator from the event loop, one `next()` per worker-thread hop."""
+    it = iter(sync_iterable)
+    sentinel = object()
+    while True:
+        value = await loop.run_in_executor(executor, next, it, sentinel)
+        if value is sentinel:
+            break
+        yield value
+
+
 async def invoke_stream(chain, input_data, config):
     """Streams the response from the LLM back to the frontend."""
-    loop = asyncio.get_event_loop()
-    stream_generator = await loop.run_in_executor(None, lambda: chain.stream(input_data, config))
-
-    for chunk in stream_generator:
-        if isinstance(chunk, str):
-            yield chunk
-        elif isinstance(chunk, dict):
-            yield chunk.get("answer", "")
-        elif hasattr(chunk, "content"):
-            yield str(chunk.content)
-        else:
-            yield str(chunk)
+    if hasattr(chain, "astream"):
+        stream = chain.astream(input_data, config=config)
+    else:
+        # Sync-only chain: never block the loop for the whole stream.
+        # Resolve the loop once; pass positional args (no per-call lambda).
+        pool = app.state.llm_pool
+        loop = asyncio.get_running_loop()
+        stream = _aiter(await loop.run_in_executor(pool, chain.stream, input_data, config), loop, pool)
 
+    extract = None
+    async for chunk in stream:
+        if extract is None:
+            extract = _select_extractor(chunk)
+        yield extract(chunk)
 
-# --- RAG Query Endpoint ---
-@app.post("/stream_chat")
-async def stream_chat_endpoint(request: ChatRequest):
-    """Main endpoint: Streams LLM output to the frontend."""
+
+# --- RAG Query Endpoints ---
+def _prepare_chat(request: ChatRequest):
+    """
+    Validates chain readiness and builds the chain input + session config.
+    Used as a dependency so a 503 is sent before any stream starts.
+    """
     if not jarvis_chain:
         raise HTTPException(status_code=503, detail="Jarvis RAG Chain not initialized.")
 
     input_data = {"input": request.input}
     config = {"configurable": {"session_id": request.session_id}}
+    if request.sources:
+        config["configurable"]["sources"] = request.sources
+
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("🧠 Query received (session: %s, len=%d)", request.session_id, len(request.input))
+    logger.debug("Query body (session: %s) -> %s", request.session_id, request.input)
+    return input_data, config
+
+
+@app.post("/stream_chat", response_class=EventSourceResponse)
+async def stream_chat_endpoint(chat=Depends(_prepare_chat)):
+    """
+    Main endpoint: Streams LLM output to the frontend as Server-Sent Events.
+    FastAPI frames each event and adds keep-alive pings and `X-Accel-Buffering: no`.
+    """
+    input_data, config = chat
 
-    logger.info(f"🧠 Query received (session: {request.session_id}) -> {request.input}")
+    async for token in invoke_stream(jarvis_chain, input_data, config):
+        # raw_data: the token is sent as-is, not JSON-quoted.
+        yield ServerSentEvent(raw_data=token)
+
+
+@app.post("/stream_chat_raw")
+async def stream_chat_raw_endpoint(chat=Depends(_prepare_chat)):
+    """Legacy endpoint: Streams LLM output as chunked plain text."""
+    input_data, config = chat
 
     return StreamingResponse(
         invoke_stream(jarvis_chain, input_data, config),
-        media_type="text/plain"
+        media_type="text/plain",
+        headers=STREAM_HEADERS
     )
 
 
+# --- Text Extraction ---
+def _extract_pdf(data: bytes) -> str:
+    """Hands PDF parsing to the process pool and waits for the text."""
+    return app.state.pdf_pool.submit(extract_pdf_text, data).result()
+
+
+def _extract_txt_bytes(data: bytes) -> str:
+    """Decodes an uploaded text file in memory (no temp-file round-trip)."""
+    return data.decode("utf-8", errors="replace")
+
+
+# Supported upload types, keyed by lowercase extension.
+_EXTRACTORS = {
+    ".pdf": _extract_pdf,
+    ".txt": _extract_txt_bytes,
+}
+
+
 # --- Dynamic Document Upload Endpoint ---
-@app.post("/upload_doc")
-async def upload_doc(file: UploadFile = File(...), session_id: str = Form("default")):
+def _ingest(vectorstore, extractor, data: bytearray, filename: str, session_id: str) -> dict:
     """
-    Accepts PDF or TXT files, extracts text, and adds to Pinecone dynamically.
+    Blocking half of `/upload_doc`: extracts text, splits it, and upserts the chunks.
+    Runs on a worker thread so the event loop stays free for other requests.
     """
+    text = extractor(data)
+
+    if not text.strip():
+        return {"error": "No readable text found in the uploaded file."}
+
+    # Convert to LangChain Documents, split to fit the embedder's context
+    doc = Document(page_content=text, metadata={"source": filename, "session_id": session_id})
+    chunks = text_splitter.split_documents([doc])
+
+    # Add all chunks in one call: batched encoding + bulk upsert
+    vectorstore.add_documents(chunks)
+    logger.info("✅ Document '%s' added to Pinecone as %d chunks (session=%s)", filename, len(chunks), session_id)
+
+    return {"status": "success", "filename": filename}
+
+
+async def _read_upload(file: UploadFile) -> bytearray:
+    """Reads the upload in 1 MiB chunks into a single growing buffer."""
+    data = bytearray()
+    while chunk := await file.read(UPLOAD_READ_CHUNK):
+        data += chunk
+    return data
+
+
+async def _run_ingest(pool, vectorstore, extractor, data: bytearray, filename: str, session_id: str) -> dict:
+    """Dispatches `_ingest` to the ingest pool, folding failures into an error payload."""
     try:
-        # Save temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as tmp:
-            tmp.write(await file.read())
-            temp_path = tmp.name
-
-        # Extract text
-        if file.filename.lower().endswith(".pdf"):
-            reader = PdfReader(temp_path)
-            text = "\n".join([page.extract_text() or "" for page in reader.pages])
-        elif file.filename.lower().endswith(".txt"):
-            with open(temp_path, "r", encoding="utf-8") as f:
-                text = f.read()
-        else:
-            return {"error": "Unsupported file type. Please upload .pdf or .txt"}
+        # Ingestion reads no contextvars, so dispatch directly instead of
+        # paying asyncio.to_thread's copy_context() + ctx.run wrapper.
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(pool, _ingest, vectorstore, extractor, data, filename, session_id)
+    except Exception as e:
+        logger.error("❌ Failed to upload document: %s", e)
+        return {"error": str(e)}
 
-        os.remove(temp_path)
+    if result.get("status") == "success":
+        # New documents change what retrieval returns, for every session:
+        # drop cached Pinecone results first so no stale answer is re-cached.
+        invalidate_retrieval_cache()
+        get_semantic_cache().clear()
+    return result
 
-        if not text.strip():
-            return {"error": "No readable text found in the uploaded file."}
 
-        # Convert to LangChain Documents
-        docs = [Document(page_content=text, metadata={"source": file.filename, "session_id": session_id})]
+@app.post("/upload_doc")
+async def upload_doc(request: Request, file: UploadFile = File(...), session_id: str = Form("default")):
+    """
+    Accepts PDF or TXT files, extracts text, and adds to Pinecone dynamically.
+    """
+    try:
+        vectorstore = request.app.state.vectorstore
+        if vectorstore is None:
+            return {"error": "Vector store unavailable. Check the Pinecone configuration."}
 
-        # Initialize embeddings + vectorstore
-        embeddings = HuggingFaceEmbeddings(model_name=BGE_MODEL_NAME)
-        vectorstore = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=embeddings
-        )
+        extractor = _EXTRACTORS.get(os.path.splitext(file.filename)[1].lower())
+        if extractor is None:
+            return {"error": "Unsupported file type. Please upload .pdf or .txt"}
 
-        # Add document
-        vectorstore.add_documents(docs)
-        logger.info(f"✅ Document '{file.filename}' added to Pinecone (session={session_id})")
+        data = await _read_upload(file)
 
-        return {"status": "success", "filename": file.filename}
+        digest = hashlib.sha256(data)
+        digest.update(f"|{file.filename}|{session_id}".encode())
+        key = digest.hexdigest()
+        task = _inflight_uploads.get(key)
+        if task is not None:
+            logger.info("⏳ Joining in-flight ingestion of '%s' (session=%s)", file.filename, session_id)
+        else:
+            task = asyncio.ensure_future(_run_ingest(
+                request.app.state.ingest_pool, vectorstore, extractor, data, file.filename, session_id
+            ))
+            _inflight_uploads[key] = task
+            # Forgotten only once the executor job has finished, so a retry after a
+            # client disconnect joins the running ingestion instead of repeating it.
+            task.add_done_callback(lambda _: _inflight_uploads.pop(key, None))
+        # Shielded: a disconnecting client must not cancel an ingestion others wait on.
+        return await asyncio.shield(task)
 
     except Exception as e:
-        logger.error(f"❌ Failed to upload document: {e}")
+        logger.error("❌ Failed to upload document: %s", e)
         return {"error": str(e)}
 
 
@@ -166,5 +353,31 @@ def read_root():
 
 
 # --- Run Server ---
+def _server_impls():
+    """Picks uvloop/httptools when installed (not on Windows), else the stdlib defaults."""
+    try:
+        import uvloop  # noqa: F401
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        http = "httptools"
+    except ImportError:
+        http = "h11"
+    return loop, http
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
+    loop_impl, http_impl = _server_impls()
+    # Chat memory and caches live in-process, so more than one worker
+    # only makes sense behind a session-sticky load balancer.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop=loop_impl,
+        http=http_impl,
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        log_level="info",
+    )
@@ -0,0 +1,56 @@
+import threading
+from typing import List
+
+from cachetools import LRUCache
+from langchain_core.embeddings import Embeddings
+
+from .onnx_embeddings import l2_normalize
+
+
+class CachedBgeEmbeddings(Embeddings):
+    """
+    LRU cache around a BGE `Embeddings` backend (PyTorch or ONNX) for query vectors.
+
+    Repeated questions skip the encoder forward pass entirely. Document
+    embedding passes straight through: uploaded chunks rarely repeat and
+    would only evict hot queries.
+
+    With `normalize=True` the backend's raw vectors are L2-normalized here in
+    NumPy, instead of per batch by `torch.nn.functional.normalize`.
+    """
+
+    def __init__(self, inner: Embeddings, maxsize: int = 4096, normalize: bool = False):
+        self.inner = inner
+        self.normalize = normalize
+        self._cache: LRUCache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            cached = self._cache.get(text)
+        if cached is not None:
+            return cached
+        vector = self.inner.embed_query(text)
+        if self.normalize:
+            vector = l2_normalize(vector)[0].tolist()
+        with self._lock:
+            self._cache[text] = vector
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Batched `embed_query`: serves hits from cache, encodes misses in one pass."""
+        with self._lock:
+            vectors = [self._cache.get(t) for t in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            fresh = self.embed_documents([texts[i] for i in missing])
+            with self._lock:
+                for i, vector in zip(missing, fresh):
+                    vectors[i] = self._cache[texts[i]] = vector
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.inner.embed_documents(texts)
+        if self.normalize and vectors:
+            return l2_normalize(vectors).tolist()
+        return vectors
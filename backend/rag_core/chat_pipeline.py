@@ -1,19 +1,38 @@
 import os
+import asyncio
+import hashlib
 import logging
 import random
-from typing import Dict, Any, List
+import re
+import threading
+import weakref
+import torch
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from cachetools import LRUCache
 
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables import RunnableWithMessageHistory, RunnableLambda
+from langchain_core.runnables import RunnableConfig, RunnableWithMessageHistory, RunnableLambda
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_ollama.llms import OllamaLLM
 from langchain_pinecone import PineconeVectorStore
+from pinecone import Pinecone
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_core.chat_history import InMemoryChatMessageHistory, BaseChatMessageHistory
-from langchain_classic.chains import create_history_aware_retriever
-from langchain_core.messages import HumanMessage, AIMessage
+from langchain_classic.chains import create_history_aware_retriever, create_retrieval_chain
+from langchain_classic.chains.combine_documents import create_stuff_documents_chain
+from langchain_classic.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+
+from .cached_embeddings import CachedBgeEmbeddings
+from .retrieval_cache import CachedRetriever
+from .semantic_cache import SemanticCache
 
 # --- Configuration ---
 load_dotenv()
@@ -22,12 +41,43 @@ logger = logging.getLogger(__name__)
 
 STORE: Dict[str, BaseChatMessageHistory] = {}
 
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE") or None  # per-tenant partition; None = default
+RETRIEVAL_SCOPE_CACHE = 32  # distinct `sources` filters kept with their own retriever + cache
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3:8b-instruct-q4_K_M")  # 4-bit weights: ~5 GB vs ~16 GB FP16
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+OLLAMA_NUM_GPU = int(os.getenv("OLLAMA_NUM_GPU")) if os.getenv("OLLAMA_NUM_GPU") else None  # layers to offload
+LLM_TEMPERATURE = 0.4
+# Keeps the model + KV cache resident; Ollama takes a duration ("60m") or seconds (-1 = forever).
+_keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "60m")
+OLLAMA_KEEP_ALIVE = int(_keep_alive) if _keep_alive.lstrip("-").isdigit() else _keep_alive
+OLLAMA_TIMEOUT = 60
+# Identical prompts within a namespace reuse one sampled answer; change it to resample.
+LLM_CACHE_NAMESPACE = os.getenv("LLM_CACHE_NAMESPACE", "default")
+LLM_CACHE_SIZE = 1024
+CACHE_REPLAY_CHUNK = 16  # characters per streamed chunk when replaying a semantic cache hit
 BGE_MODEL_NAME = os.getenv("BGE_MODEL_NAME", "BAAI/bge-small-en-v1.5")
+BGE_ONNX_DIR = os.getenv("BGE_ONNX_DIR")  # optional: exported/quantized ONNX model
+EMBED_BATCH_SIZE = 64
+QUERY_EMBED_CACHE_SIZE = 4096
+HISTORY_TOKEN_LIMIT = int(os.getenv("HISTORY_TOKEN_LIMIT", "200"))  # older turns get summarized
+MAX_HISTORY_MESSAGES = 50  # hard cap on raw messages kept per session
+HISTORY_PROMPT_TOKENS = int(os.getenv("HISTORY_PROMPT_TOKENS", "1024"))  # history budget per prefill
+# "lambda": manual RunnableLambda chain (small talk + LLM cache); "lcel": create_retrieval_chain
+JARVIS_CHAIN_VARIANT = os.getenv("JARVIS_CHAIN_VARIANT", "lambda").lower()
+
+_LLM_CACHE: LRUCache = LRUCache(maxsize=LLM_CACHE_SIZE)
+_LLM_CACHE_LOCK = threading.Lock()
+# Session summaries are written in the background, off the request path.
+_SUMMARY_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+# Every retriever still referenced (by `_get_retriever` or a chain), for invalidation.
+_LIVE_RETRIEVERS: "weakref.WeakSet[CachedRetriever]" = weakref.WeakSet()
 
 # --- System Prompt ---
-JARVIS_SYSTEM_PROMPT = """
+# Kept free of template variables so it is a byte-identical prefix on every
+# turn, letting Ollama reuse its KV cache for the persona instead of re-prefilling.
+JARVIS_PERSONA = """
 You are Jarvis — a highly intelligent, eloquent, and slightly witty AI assistant with a refined British tone. You speak with precision, composure, and dry humor. Always address the user as “Boss.”
 
 Your purpose is to help the Boss with information, reasoning, and simple coding or analytical tasks using the provided CONTEXT. Stay confident, articulate, and respectful, with occasional subtle humor. Never act robotic or generic.
@@ -43,51 +93,352 @@ Use bullet points or paragraphs for readability.
 Always sound calm, clever, and professional.
 
 Knowledge rules:
-You must only use the CONTEXT below, which contains the Boss’s private notes and files.
+You must only use the CONTEXT provided with each question, which contains the Boss’s private notes and files.
 If an answer isn’t found there, say:
 “I apologize, Boss, but that appears to be outside my current knowledge base.”
 If the question is unrelated, say:
 “I’m sorry, Boss, but perhaps you should’ve added that to your college notes as well.”
 
 You may tease or joke lightly, but never disrespectfully. Stay focused, composed, and dependable.
+"""
 
-
-CONTEXT:
+# Retrieved notes change every turn, so they go after the static prefix.
+CONTEXT_TEMPLATE = """CONTEXT:
 {context}
 """
 
+# --- QA Prompt ---
+# Built once at import. The persona is a literal SystemMessage rather than a
+# template, so it is never re-rendered; only context/input/history vary per turn.
+_QA_PROMPT = ChatPromptTemplate.from_messages([
+    SystemMessage(content=JARVIS_PERSONA),
+    MessagesPlaceholder("chat_history"),
+    ("human", CONTEXT_TEMPLATE),
+    ("human", "{input}"),
+])
+
+# --- Small-Talk Detection ---
+# Short and casual → likely greeting or small talk
+CASUAL_KEYWORDS = (
+    "hey", "hi", "hello", "yo", "hola", "what’s up", "what's up", "how are you",
+    "how’s it going", "how's it going", "good morning", "good evening", "good night",
+    "sup", "jarvis?", "you there", "are you online"
+)
+SMALLTALK_RESPONSES = (
+    "At your service, Boss.",
+    "Good day, Boss. How may I assist you?",
+    "Right here, Boss — systems operational.",
+    "Indeed, Boss. What’s on today’s agenda?",
+    "Always listening, Boss. How can I help?",
+)
+
+# Compiled once: one C-level scan per check instead of a Python loop per keyword.
+_CASUAL_RE = re.compile(
+    r"(?<!\w)(?:" + "|".join(map(re.escape, CASUAL_KEYWORDS)) + r")(?!\w)", re.IGNORECASE
+)
+_TASK_RE = re.compile(r"(?<!\w)(?:explain|define|what is|how to|why)(?!\w)|\?", re.IGNORECASE)
+
+# Single-word greetings that usually open a message: checked with one set lookup.
+_GREETING_WORDS = frozenset(kw for kw in CASUAL_KEYWORDS if kw.isalpha())
+
+def is_smalltalk(text: str) -> bool:
+    # short messages under ~5 words with casual tone; input is already stripped,
+    # so counting spaces bounds the word count without allocating a split list
+    if text.count(" ") > 4 or _TASK_RE.search(text):
+        return False
+    head = text.split(None, 1)
+    if head and head[0].rstrip(",.!").lower() in _GREETING_WORDS:
+        return True
+    return _CASUAL_RE.search(text) is not None
+
+def smalltalk_reply(question: str):
+    """Returns a canned greeting for small talk, or None for a real question."""
+    if is_smalltalk(question):
+        return random.choice(SMALLTALK_RESPONSES)
+    return None
+
 # --- Helpers ---
+@dataclass(frozen=True, slots=True)
+class ChainInput:
+    """One turn's input, normalized once at the chain entry."""
+    question: str
+    chat_history: List[BaseMessage]  # stays a list: MessagesPlaceholder rejects tuples
+
+    @classmethod
+    def from_inputs(cls, inputs: Dict[str, Any]) -> "ChainInput":
+        return cls(inputs.get("input", "").strip(), _trim_history(inputs.get("chat_history") or []))
+
+    def as_retriever_input(self) -> Dict[str, Any]:
+        return {"input": self.question, "chat_history": self.chat_history}
+
+def _approx_tokens(message: BaseMessage) -> int:
+    # ~4 characters per token for English text; avoids a tokenizer pass per turn.
+    return len(message.content) // 4 + 1
+
+def _approx_token_ids(text: str) -> List[int]:
+    # Same estimate, shaped as the tokenizer hook LangChain counts with. Without it
+    # the summary memory downloads the GPT-2 tokenizer from the Hugging Face Hub.
+    return [0] * (len(text) // 4 + 1)
+
+def _trim_history(messages: List[BaseMessage], max_tokens: int = HISTORY_PROMPT_TOKENS) -> List[BaseMessage]:
+    """
+    Keeps the newest turns that fit in `max_tokens`, so prefill cost has a fixed
+    ceiling. A leading summary message is kept; history restarts on a human turn.
+    """
+    head = messages[:1] if messages and isinstance(messages[0], SystemMessage) else []
+    budget = max_tokens - sum(map(_approx_tokens, head))
+    start = len(messages)
+    while start > len(head):
+        cost = _approx_tokens(messages[start - 1])
+        if cost > budget:
+            break
+        budget -= cost
+        start -= 1
+    while start < len(messages) and not isinstance(messages[start], HumanMessage):
+        start += 1
+    if start == len(head):
+        return messages
+    return head + messages[start:]
+
 def _combine_documents(docs: List[Document]) -> str:
-    return "\n\n".join(doc.page_content for doc in docs)
+    # str.join materializes a generator into a list anyway; build it directly.
+    return "\n\n".join([doc.page_content for doc in docs])
+
+def _replay(answer: str) -> Iterator[str]:
+    """Replays a cached answer in small chunks so the client still sees a stream."""
+    for i in range(0, len(answer), CACHE_REPLAY_CHUNK):
+        yield answer[i:i + CACHE_REPLAY_CHUNK]
+
+class SummaryBufferHistory(BaseChatMessageHistory):
+    """
+    Chat history adapter over `ConversationSummaryBufferMemory`.
+
+    Recent turns are kept verbatim up to `max_token_limit`; older turns are
+    folded into a rolling summary, so the prompt stops growing with every turn.
+    Summarizing is an extra LLM call, so it runs on `_SUMMARY_POOL` after the
+    turn is recorded: the response stream closes without waiting for it.
+    """
+
+    def __init__(self, llm, max_token_limit: int, max_messages: int):
+        self.memory = ConversationSummaryBufferMemory(
+            llm=llm,
+            max_token_limit=max_token_limit,
+            memory_key="chat_history",
+            return_messages=True,
+            chat_memory=InMemoryChatMessageHistory(),
+        )
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._pruning = False  # at most one summarization in flight per session
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        with self._lock:
+            recent = self.memory.chat_memory.messages
+            if self.memory.moving_summary_buffer:
+                return [SystemMessage(content=self.memory.moving_summary_buffer), *recent]
+            return list(recent)
+
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        with self._lock:
+            self.memory.chat_memory.add_messages(messages)
+            self._cap()
+            if self._pruning:
+                return  # the running pass re-checks the buffer before it exits
+            self._pruning = True
+        _SUMMARY_POOL.submit(self._prune)
+
+    async def aadd_messages(self, messages: List[BaseMessage]) -> None:
+        # Never blocks: summarization is already off the calling thread.
+        self.add_messages(messages)
+
+    def _prune(self) -> None:
+        """
+        `ConversationSummaryBufferMemory.prune`, but the pruned turns stay in the
+        buffer until their summary exists, so readers never see them vanish.
+        """
+        memory = self.memory
+        try:
+            while True:
+                with self._lock:
+                    buffer = list(memory.chat_memory.messages)
+                    cut = 0
+                    while memory.llm.get_num_tokens_from_messages(buffer[cut:]) > memory.max_token_limit:
+                        cut += 1
+                    if not cut:
+                        # Checked and released together, so a turn added meanwhile is never skipped.
+                        self._pruning = False
+                        return
+                    summary = memory.moving_summary_buffer
+                new_summary = memory.predict_new_summary(buffer[:cut], summary)
+                pruned = set(map(id, buffer[:cut]))
+                with self._lock:
+                    chat_memory = memory.chat_memory
+                    chat_memory.messages = [m for m in chat_memory.messages if id(m) not in pruned]
+                    memory.moving_summary_buffer = new_summary
+        except Exception as e:
+            logger.warning("Could not summarize chat history: %s", e)
+            with self._lock:
+                self._pruning = False
+
+    def _cap(self) -> None:
+        """Caller holds `_lock`."""
+        chat_memory = self.memory.chat_memory
+        if len(chat_memory.messages) > self.max_messages:
+            chat_memory.messages = chat_memory.messages[-self.max_messages:]
+
+    def clear(self) -> None:
+        with self._lock:
+            self.memory.clear()
 
 def get_session_history(session_id: str) -> BaseChatMessageHistory:
     if session_id not in STORE:
-        STORE[session_id] = InMemoryChatMessageHistory()
-        logger.info(f"Created new memory store for session: {session_id}")
+        STORE[session_id] = SummaryBufferHistory(
+            _get_llm(), max_token_limit=HISTORY_TOKEN_LIMIT, max_messages=MAX_HISTORY_MESSAGES
+        )
+        logger.info("Created new memory store for session: %s", session_id)
     return STORE[session_id]
 
+def _llm_cache_key(prompt: str) -> tuple:
+    prompt_hash = hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+    return (LLM_CACHE_NAMESPACE, OLLAMA_MODEL, LLM_TEMPERATURE, prompt_hash)
+
+def _llm_cache_get(key: tuple):
+    with _LLM_CACHE_LOCK:
+        return _LLM_CACHE.get(key)
+
+def _llm_cache_put(key: tuple, response) -> str:
+    answer = response.content.strip() if hasattr(response, "content") else str(response).strip()
+    with _LLM_CACHE_LOCK:
+        _LLM_CACHE[key] = answer
+    return answer
+
+def _stream_cached_llm(llm, prompt: str):
+    """
+    Yields LLM tokens as they are decoded, memoizing the full answer per
+    (namespace, model, temperature, prompt). A hit is yielded in one piece.
+    """
+    key = _llm_cache_key(prompt)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for token in llm.stream(prompt):
+        parts.append(token)
+        yield token
+    # Joined once, and only cached when the decode ran to completion.
+    _llm_cache_put(key, "".join(parts))
+
+async def _astream_cached_llm(llm, prompt: str):
+    """Async variant of `_stream_cached_llm`, sharing the same cache."""
+    key = _llm_cache_key(prompt)
+    cached = _llm_cache_get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    async for token in llm.astream(prompt):
+        parts.append(token)
+        yield token
+    _llm_cache_put(key, "".join(parts))
+
+@lru_cache(maxsize=1)
+def _get_llm() -> OllamaLLM:
+    """Shared Ollama client, used by the chain and by session summary memory."""
+    return OllamaLLM(
+        model=OLLAMA_MODEL,
+        temperature=LLM_TEMPERATURE,
+        keep_alive=OLLAMA_KEEP_ALIVE,
+        num_ctx=OLLAMA_NUM_CTX,
+        num_gpu=OLLAMA_NUM_GPU,
+        stop=["<|eot_id|>", "<|start_header_id|>", "Human:", "Assistant:"],
+        custom_get_token_ids=_approx_token_ids,  # token counting for summary memory
+        # Passed to the underlying httpx sync/async clients: reuse keep-alive
+        # connections so concurrent sessions don't each open a new socket.
+        client_kwargs={
+            "timeout": OLLAMA_TIMEOUT,
+            "limits": httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        },
+    )
+
+def _load_embeddings() -> Embeddings:
+    """Builds the BGE backend: ONNX Runtime when configured, otherwise PyTorch."""
+    if BGE_ONNX_DIR:
+        from .onnx_embeddings import OnnxBgeEmbeddings
+        # Exports + INT8-quantizes BGE into BGE_ONNX_DIR on first run if missing.
+        return OnnxBgeEmbeddings(BGE_ONNX_DIR, model_name=BGE_MODEL_NAME, batch_size=EMBED_BATCH_SIZE)
+
+    logger.info("Loading embedding model: %s", BGE_MODEL_NAME)
+    use_cuda = torch.cuda.is_available()
+    return HuggingFaceEmbeddings(
+        model_name=BGE_MODEL_NAME,
+        model_kwargs={
+            "device": "cuda" if use_cuda else "cpu",
+            # Forwarded to `from_pretrained`: FP16 only where it is actually faster.
+            "model_kwargs": {"torch_dtype": torch.float16 if use_cuda else torch.float32},
+        },
+        # Raw vectors: `get_embeddings` L2-normalizes them in NumPy.
+        encode_kwargs={"batch_size": EMBED_BATCH_SIZE},
+    )
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> Embeddings:
+    """Loads the BGE embedding model once and shares it across callers."""
+    # The ONNX backend already returns normalized vectors.
+    return CachedBgeEmbeddings(
+        _load_embeddings(), maxsize=QUERY_EMBED_CACHE_SIZE, normalize=not BGE_ONNX_DIR
+    )
+
+@lru_cache(maxsize=1)
+def get_semantic_cache() -> SemanticCache:
+    """Answer cache keyed by standalone question + retrieval scope, shared across sessions."""
+    return SemanticCache(get_embeddings())
+
+@lru_cache(maxsize=1)
+def _get_pinecone() -> Pinecone:
+    """One Pinecone client per process, so its HTTP connection pool stays warm."""
+    return Pinecone(api_key=PINECONE_API_KEY)
+
+@lru_cache(maxsize=1)
+def get_vectorstore() -> PineconeVectorStore:
+    """Shared vectorstore for retrieval and uploads."""
+    return PineconeVectorStore(
+        index=_get_pinecone().Index(PINECONE_INDEX_NAME),
+        embedding=get_embeddings(),
+        namespace=PINECONE_NAMESPACE,
+    )
+
+def retrieval_scope(config: Optional[RunnableConfig]) -> Tuple[str, ...]:
+    """Normalized `sources` restriction from a run config (hashable, order-independent)."""
+    sources = (config or {}).get("configurable", {}).get("sources") or ()
+    return tuple(sorted(set(sources)))
+
+@lru_cache(maxsize=RETRIEVAL_SCOPE_CACHE)
+def _get_retriever(sources: Tuple[str, ...] = ()) -> CachedRetriever:
+    """
+    Shared across sessions so they all benefit from one retrieval cache.
+    A `sources` scope becomes a Pinecone metadata filter, so the index only
+    walks matching vectors; each scope keeps its own cache.
+    """
+    search_filter = {"source": {"$in": list(sources)}} if sources else None
+    retriever = CachedRetriever(
+        vectorstore=get_vectorstore(), embeddings=get_embeddings(), k=3, search_filter=search_filter
+    )
+    _LIVE_RETRIEVERS.add(retriever)
+    return retriever
+
+def invalidate_retrieval_cache() -> None:
+    """Forgets cached Pinecone results in every scope, e.g. after an upload."""
+    for retriever in list(_LIVE_RETRIEVERS):
+        retriever.clear()
+
 # --- Core Chain ---
 def get_jarvis_chain():
     try:
         logger.info("Initializing Jarvis RAG chain...")
 
-        llm = OllamaLLM(
-            model=OLLAMA_MODEL,
-            temperature=0.4,
-            stop=["<|eot_id|>", "<|start_header_id|>", "Human:", "Assistant:"],
-        )
-
-        embeddings = HuggingFaceEmbeddings(
-            model_name=BGE_MODEL_NAME,
-            model_kwargs={"device": "cpu"},
-            encode_kwargs={"normalize_embeddings": True},
-        )
-
-        vectorstore = PineconeVectorStore.from_existing_index(
-            index_name=PINECONE_INDEX_NAME,
-            embedding=embeddings,
-        )
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 3})
+        llm = _get_llm()
 
         # --- Contextual question expansion ---
         contextualize_q_prompt = ChatPromptTemplate.from_messages([
@@ -96,72 +447,107 @@ def get_jarvis_chain():
             ("human", "{input}"),
         ])
 
-        history_aware_retriever = create_history_aware_retriever(
-            llm, retriever, contextualize_q_prompt
-        )
+        rephrase_question = contextualize_q_prompt | llm | StrOutputParser()
 
-        # --- QA prompt ---
-        qa_prompt = ChatPromptTemplate.from_messages([
-            ("system", JARVIS_SYSTEM_PROMPT),
-            MessagesPlaceholder("chat_history"),
-            ("human", "{input}"),
-        ])
+        @lru_cache(maxsize=RETRIEVAL_SCOPE_CACHE)
+        def history_aware_retriever(sources: Tuple[str, ...] = ()):
+            return create_history_aware_retriever(
+                llm, _get_retriever(sources), contextualize_q_prompt
+            )
 
-        # --- Define RAG logic inside RunnableLambda ---
-        def rag_logic(inputs: Dict[str, Any]) -> str:
-            question = inputs.get("input", "").strip()
-            chat_history = inputs.get("chat_history", [])
-
-            # === SMART SMALL-TALK DETECTION ===
-            q_lower = question.lower()
-
-            # Short and casual → likely greeting or small talk
-            casual_keywords = [
-                "hey", "hi", "hello", "yo", "hola", "what’s up", "how are you",
-                "how’s it going", "good morning", "good evening", "good night",
-                "sup", "jarvis?", "you there", "are you online"
-            ]
-
-            def is_smalltalk(text: str) -> bool:
-                # short messages under ~5 words with casual tone
-                return (
-                    len(text.split()) <= 5
-                    and any(kw in text for kw in casual_keywords)
-                    and not any(term in text for term in ["explain", "define", "what is", "how to", "why", "?"])
-                )
-
-            if is_smalltalk(q_lower):
-                responses = [
-                    "At your service, Boss.",
-                    "Good day, Boss. How may I assist you?",
-                    "Right here, Boss — systems operational.",
-                    "Indeed, Boss. What’s on today’s agenda?",
-                    "Always listening, Boss. How can I help?",
-                ]
-                return random.choice(responses)
-
-            # Retrieve documents
-            retrieved_docs = history_aware_retriever.invoke({
-                "input": question,
-                "chat_history": chat_history
-            })
-            context_text = _combine_documents(retrieved_docs)
+        # Build the default scope now: a Pinecone or embedding misconfiguration
+        # fails here, at startup, instead of mid-stream on the first request.
+        history_aware_retriever(())
 
+        # --- Define RAG logic inside RunnableLambda ---
+        def build_prompt(turn: ChainInput, retrieved_docs: List[Document]) -> str:
             # Build prompt with retrieved context
-            prompt = qa_prompt.format(
-                context=context_text,
-                input=question,
-                chat_history=chat_history
+            return _QA_PROMPT.format_prompt(
+                context=_combine_documents(retrieved_docs),
+                input=turn.question,
+                chat_history=turn.chat_history
+            ).to_string()
+
+        def rag_logic(inputs: Dict[str, Any], config: RunnableConfig) -> Iterator[str]:
+            turn = ChainInput.from_inputs(inputs)
+
+            reply = smalltalk_reply(turn.question)
+            if reply is not None:
+                yield reply
+                return
+
+            # Standalone question: the semantic cache and the retriever both key on it,
+            # so a follow-up never matches an answer given for another topic.
+            question = turn.question
+            if turn.chat_history:
+                question = rephrase_question.invoke(turn.as_retriever_input(), config).strip()
+
+            sources = retrieval_scope(config)
+            cache_scope = "|".join(sources)
+            answer, query_emb = get_semantic_cache().get(cache_scope, question)
+            if answer is not None:
+                logger.info("⚡ Semantic cache hit (scope: %s)", sources or "all")
+                yield from _replay(answer)
+                return
+
+            # Retrieve documents (the query vector is already in the embedding cache)
+            retrieved_docs = _get_retriever(sources).invoke(question)
+            prompt = build_prompt(turn, retrieved_docs)
+
+            # Stream model output token by token (identical prompts are served from cache)
+            parts = []
+            for token in _stream_cached_llm(llm, prompt):
+                parts.append(token)
+                yield token
+            get_semantic_cache().put(cache_scope, question, "".join(parts), query_emb)
+
+        async def arag_logic(inputs: Dict[str, Any], config: RunnableConfig) -> AsyncIterator[str]:
+            """Async twin of `rag_logic` used by `astream`/`ainvoke`; never blocks the loop."""
+            turn = ChainInput.from_inputs(inputs)
+
+            # Small talk returns before any retrieval is scheduled.
+            reply = smalltalk_reply(turn.question)
+            if reply is not None:
+                yield reply
+                return
+
+            question = turn.question
+            if turn.chat_history:
+                question = (await rephrase_question.ainvoke(turn.as_retriever_input(), config)).strip()
+
+            sources = retrieval_scope(config)
+            cache_scope = "|".join(sources)
+            # A cache miss runs the BGE forward pass; keep it off the event loop.
+            answer, query_emb = await asyncio.to_thread(get_semantic_cache().get, cache_scope, question)
+            if answer is not None:
+                logger.info("⚡ Semantic cache hit (scope: %s)", sources or "all")
+                for chunk in _replay(answer):
+                    yield chunk
+                return
+
+            retrieved_docs = await _get_retriever(sources).ainvoke(question)
+            prompt = build_prompt(turn, retrieved_docs)
+
+            parts = []
+            async for token in _astream_cached_llm(llm, prompt):
+                parts.append(token)
+                yield token
+            get_semantic_cache().put(cache_scope, question, "".join(parts), query_emb)
+
+        if JARVIS_CHAIN_VARIANT == "lcel":
+            # Stock LCEL pipeline: streams {"answer": ...} chunks, skips small talk and the answer caches
+            # The retriever is picked per call so the request's `sources` scope applies here too.
+            scoped_retriever = RunnableLambda(
+                lambda x, config: history_aware_retriever(retrieval_scope(config)).invoke(x, config),
+                afunc=lambda x, config: history_aware_retriever(retrieval_scope(config)).ainvoke(x, config),
             )
-
-            # Get model output
-            response = llm.invoke(prompt)
-            if hasattr(response, "content"):
-                return response.content.strip()
-            return str(response).strip()
-
-        # ✅ Wrap rag_logic inside RunnableLambda
-        rag_chain = RunnableLambda(rag_logic)
+            qa_chain = create_stuff_documents_chain(llm, _QA_PROMPT)
+            rag_chain = create_retrieval_chain(scoped_retriever, qa_chain)
+            output_key = "answer"
+        else:
+            # ✅ Wrap rag_logic inside RunnableLambda (sync + async generators stream tokens)
+            rag_chain = RunnableLambda(rag_logic, afunc=arag_logic)
+            output_key = None
 
         # ✅ Add message memory management
         final_chain = RunnableWithMessageHistory(
@@ -169,9 +555,10 @@ def get_jarvis_chain():
             get_session_history,
             input_messages_key="input",
             history_messages_key="chat_history",
+            output_messages_key=output_key,
         )
 
-        logger.info("✅ Jarvis chain initialized successfully.")
+        logger.info("✅ Jarvis chain initialized successfully (%s variant).", JARVIS_CHAIN_VARIANT)
         return final_chain
 
     except Exception as e:
@@ -0,0 +1,54 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+def embedding_key(model_name: str, text: str) -> str:
+    """Cache key for one chunk: the vector depends on both the model and the text."""
+    return hashlib.sha256(f"{model_name}\x00{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent SQLite store of document embeddings keyed by `embedding_key`.
+
+    Re-running ingestion over an unchanged knowledge base then only embeds
+    new or edited chunks. Vectors are stored as raw float32 bytes.
+    """
+
+    # SQLite caps bound parameters per statement (999 on older builds).
+    _LOOKUP_BATCH = 900
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, vec BLOB NOT NULL)"
+            )
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), self._LOOKUP_BATCH):
+                batch = keys[i:i + self._LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, List[float]]]) -> None:
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)", rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
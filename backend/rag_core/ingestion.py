@@ -1,62 +1,157 @@
 import os
+
+# Size the OpenMP/MKL pools to every core before torch loads its BLAS runtime.
+CPU_THREADS = os.cpu_count() or 1
+os.environ.setdefault("OMP_NUM_THREADS", str(CPU_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(CPU_THREADS))
+
+import glob
+from collections import deque
+from itertools import islice
+from typing import Iterable, Iterator
+from functools import lru_cache
+import torch
+from uuid import uuid4
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
+# A BGE forward pass has little inter-op parallelism, so keep that pool small.
+# Set once per process: torch refuses to resize it a second time.
+torch.set_num_interop_threads(2)
+
 # 1. LangChain Document Loaders & Splitters
-from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader, TextLoader
+from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 # 2. Embedding Model (MODERN FIX)
 from langchain_huggingface import HuggingFaceEmbeddings # ✅ MODERN IMPORT
 
 # 3. Vector Store (Pinecone)
 from pinecone import Pinecone, ServerlessSpec
-from langchain_pinecone import PineconeVectorStore
+try:
+    # gRPC transport (pip install "pinecone[grpc]"): binary protobuf, multiplexed upserts
+    from pinecone.grpc import PineconeGRPC
+except ImportError:
+    PineconeGRPC = None
+
+# 4. Persistent embedding cache + ONNX backend (importable both as a package module and as a script)
+try:
+    from .embedding_cache import EmbeddingCache, embedding_key
+    from .onnx_embeddings import OnnxBgeEmbeddings
+except ImportError:
+    from embedding_cache import EmbeddingCache, embedding_key
+    from onnx_embeddings import OnnxBgeEmbeddings
 
 # --- Configuration ---
 load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 PINECONE_ENVIRONMENT = os.getenv("PINECONE_ENVIRONMENT")
+PINECONE_NAMESPACE = os.getenv("PINECONE_NAMESPACE") or None
 
 KNOWLEDGE_DIR = "./knowledge_base"
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+# Measured in BGE tokens: chunks fit the model's 512-token window instead of being truncated.
+CHUNK_SIZE = 450
+CHUNK_OVERLAP = 50
 BGE_MODEL_NAME = "BAAI/bge-small-en-v1.5"
 BGE_DIMENSION = 384 
+BGE_ONNX_DIR = os.getenv("BGE_ONNX_DIR")  # optional: INT8 ONNX Runtime model, exported on first use
+# INT8 vectors differ slightly from FP32 ones, so they get their own cache entries.
+EMBED_CACHE_MODEL = f"{BGE_MODEL_NAME}+onnx-int8" if BGE_ONNX_DIR else BGE_MODEL_NAME
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "./embedding_cache.sqlite3")
+EMBED_BATCH_SIZE = 256 if torch.cuda.is_available() else 128  # chunks per BGE forward pass
+UPSERT_BATCH_SIZE = 100  # vectors per Pinecone upsert request
+UPSERT_POOL_THREADS = 8  # REST client threads running upserts while the next batch embeds
+MAX_INFLIGHT_UPSERTS = 20  # drain pending upserts beyond this to bound memory and rate
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))  # 1 = load PDFs serially
+
+_INDEX = None  # shared index handle, built on first use by `get_index`
 
 # --- Functions ---
 
-def load_documents(directory: str) -> list[Document]:
-    """Loads all PDF and TXT documents from the specified directory."""
+def _load_one_pdf(path: str) -> list[Document]:
+    """Parses a single PDF; runs in a worker process, so it shares no state."""
+    return PyPDFLoader(path).load()
+
+def iter_load_documents(directory: str, workers: int = INGEST_WORKERS) -> Iterator[Document]:
+    """
+    Yields the pages of every PDF in the directory, parsed in worker processes.
+    At most two files per worker are in flight, so parsed pages never pile up
+    ahead of the embedder.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, "**", "*.pdf"), recursive=True))
+    if workers <= 1 or len(paths) <= 1:
+        # Sequential path: easier to debug and no process start-up cost.
+        for path in paths:
+            yield from PyPDFLoader(path).lazy_load()
+        return
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        window = deque()
+        for path in paths:
+            window.append(pool.submit(_load_one_pdf, path))
+            if len(window) >= 2 * workers:
+                yield from window.popleft().result()
+        while window:
+            yield from window.popleft().result()
+
+def load_documents(directory: str, workers: int = INGEST_WORKERS) -> list[Document]:
+    """Loads all PDF documents from the specified directory into memory."""
     print("-> Loading documents...")
     
-    pdf_loader = DirectoryLoader(
-        directory, glob="**/*.pdf", loader_cls=PyPDFLoader, recursive=True
-    )
-    documents = pdf_loader.load()
+    documents = list(iter_load_documents(directory, workers))
     
-    print(f"   Loaded {len(documents)} source pages/documents.")
+    print(f"   Loaded {len(documents)} source pages/documents.")
     if not documents:
-        print("   WARNING: Document list is empty. Check the files in the knowledge_base folder.")
+        print("   WARNING: Document list is empty. Check the files in the knowledge_base folder.")
     return documents
 
+@lru_cache(maxsize=1)
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Splitter measuring chunks with BGE's own tokenizer; built once and reused."""
+    from transformers import AutoTokenizer
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        AutoTokenizer.from_pretrained(BGE_MODEL_NAME),
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+    )
+
+def split_documents_stream(documents: Iterable[Document]) -> Iterator[Document]:
+    """Splits documents one at a time, so only the current document's chunks are held."""
+    splitter = get_text_splitter()
+    for doc in documents:
+        yield from splitter.split_documents([doc])
+
 def split_documents(documents: list[Document]) -> list[Document]:
     """Splits documents into smaller, semantically meaningful chunks."""
     print("-> Splitting documents...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len
-    )
-    chunks = text_splitter.split_documents(documents)
+    chunks = list(split_documents_stream(documents))
     print(f"   Created {len(chunks)} text chunks.")
     return chunks
 
-def initialize_embeddings():
-    """Initializes the BGE embedding model on CPU."""
-    print(f"-> Initializing {BGE_MODEL_NAME} embedding model on CPU...")
+def initialize_embeddings() -> Embeddings:
+    """
+    Initializes the BGE embedding model: INT8 ONNX Runtime when BGE_ONNX_DIR is set,
+    otherwise PyTorch (FP16 on CUDA when available, else all CPU cores).
+    """
+    if BGE_ONNX_DIR:
+        print(f"-> Initializing {BGE_MODEL_NAME} INT8 ONNX Runtime model from {BGE_ONNX_DIR}...")
+        return OnnxBgeEmbeddings(BGE_ONNX_DIR, model_name=BGE_MODEL_NAME, batch_size=EMBED_BATCH_SIZE)
+
+    use_cuda = torch.cuda.is_available()
+    device = "cuda" if use_cuda else "cpu"
+    print(f"-> Initializing {BGE_MODEL_NAME} embedding model on {device.upper()}...")
     
-    model_kwargs = {'device': 'cpu'} 
-    encode_kwargs = {'normalize_embeddings': True} 
+    if not use_cuda:
+        # Intra-op threads run each BGE matmul across all cores.
+        torch.set_num_threads(CPU_THREADS)
+    model_kwargs = {
+        'device': device,
+        # Half-precision weights halve memory traffic and use tensor cores on the GPU.
+        'model_kwargs': {'torch_dtype': torch.float16 if use_cuda else torch.float32},
+    }
+    encode_kwargs = {'normalize_embeddings': True, 'batch_size': EMBED_BATCH_SIZE} 
     
     # ✅ FIX: Use the updated class from langchain-huggingface
     embeddings = HuggingFaceEmbeddings( 
@@ -66,14 +161,36 @@ def initialize_embeddings():
     )
     return embeddings
 
-def ingest_to_pinecone(chunks: list[Document], embeddings: HuggingFaceEmbeddings):
-    """Initializes Pinecone and uploads documents/vectors."""
+def _drain(pending: list) -> None:
+    """Waits for in-flight upserts: gRPC returns futures, the REST client `ApplyResult`s."""
+    for result in pending:
+        if hasattr(result, "result"):
+            result.result()
+        else:
+            result.get()
+    pending.clear()
+
+def _has_index(pc, name: str) -> bool:
+    # `has_index` asks about one index; older clients only offer the full listing.
+    if hasattr(pc, "has_index"):
+        return pc.has_index(name)
+    return name in pc.list_indexes().names()
+
+def get_index():
+    """Creates the index if missing and returns one shared handle, reused by every upsert batch."""
+    global _INDEX
+    if _INDEX is not None:
+        return _INDEX
+
     print("-> Initializing Pinecone client...")
     
-    pc = Pinecone(api_key=PINECONE_API_KEY)
+    if PineconeGRPC is not None:
+        pc = PineconeGRPC(api_key=PINECONE_API_KEY)
+    else:
+        print("   pinecone[grpc] not installed; falling back to the REST client.")
+        pc = Pinecone(api_key=PINECONE_API_KEY)
     
-    existing_indexes = [index.name for index in pc.list_indexes()]
-    if PINECONE_INDEX_NAME not in existing_indexes:
+    if not _has_index(pc, PINECONE_INDEX_NAME):
         print(f"   Index '{PINECONE_INDEX_NAME}' not found. Creating new index...")
         
         pc.create_index(
@@ -82,11 +199,60 @@ def ingest_to_pinecone(chunks: list[Document], embeddings: HuggingFaceEmbeddings
         )
         print("   Index created successfully.")
     
-    print(f"-> Starting ingestion of {len(chunks)} chunks into Pinecone. This may take a few minutes...")
+    if PineconeGRPC is not None:
+        _INDEX = pc.Index(PINECONE_INDEX_NAME)
+    else:
+        _INDEX = pc.Index(PINECONE_INDEX_NAME, pool_threads=UPSERT_POOL_THREADS)
+    return _INDEX
+
+def ingest_to_pinecone(chunks: Iterable[Document], embeddings: Embeddings):
+    """
+    Embeds the chunks in large batches and upserts them concurrently. `chunks` may
+    be a lazy stream: only one embedding batch is materialized at a time.
+    """
+    index = get_index()
+    print("-> Starting ingestion into Pinecone. This may take a few minutes...")
     
-    PineconeVectorStore.from_documents(
-        chunks, embeddings, index_name=PINECONE_INDEX_NAME,
-    )
+    chunks = iter(chunks)
+    cache = EmbeddingCache(EMBED_CACHE_PATH)
+    pending = []
+    total = 0
+    reused = 0
+    while docs := list(islice(chunks, EMBED_BATCH_SIZE)):
+        batch = [doc.page_content for doc in docs]
+        # Repeated chunks (page headers/footers) are embedded once per batch; repeats
+        # in later batches are then served by the cache.
+        unique = list(dict.fromkeys(batch))
+        keys = {text: embedding_key(EMBED_CACHE_MODEL, text) for text in unique}
+        cached = cache.get_many(list(keys.values()))
+        # Only chunks never embedded before by this model hit the encoder.
+        missing = [text for text in unique if keys[text] not in cached]
+        if missing:
+            fresh = embeddings.embed_documents(missing)
+            cache.put_many((keys[text], vector) for text, vector in zip(missing, fresh))
+            cached.update((keys[text], vector) for text, vector in zip(missing, fresh))
+        reused += len(batch) - len(missing)
+        # Same layout as PineconeVectorStore: the chunk text lives under the "text" metadata key.
+        records = [
+            (str(uuid4()), cached[keys[doc.page_content]], {**doc.metadata, "text": doc.page_content})
+            for doc in docs
+        ]
+        # Upserts run in the background while the next batch is embedded.
+        for j in range(0, len(records), UPSERT_BATCH_SIZE):
+            pending.append(index.upsert(
+                vectors=records[j:j + UPSERT_BATCH_SIZE], namespace=PINECONE_NAMESPACE, async_req=True
+            ))
+        if len(pending) >= MAX_INFLIGHT_UPSERTS:
+            _drain(pending)
+        total += len(docs)
+        print(f"   Embedded {total} chunks.")
+
+    _drain(pending)
+    cache.close()
+    if not total:
+        print("   WARNING: No chunks to ingest. Check the files in the knowledge_base folder.")
+        return
+    print(f"   Reused {reused} cached or duplicate embeddings.")
     print("\n✅ Ingestion complete! Pinecone index is ready for RAG.")
 
 # --- Main Execution ---
@@ -97,11 +263,10 @@ if __name__ == "__main__":
         print("Please ensure you create the folder and add your college notes (PDFs) inside.")
     else:
         try:
-            raw_documents = load_documents(KNOWLEDGE_DIR)
-            if raw_documents:
-                text_chunks = split_documents(raw_documents)
-                bge_embeddings = initialize_embeddings() 
-                ingest_to_pinecone(text_chunks, bge_embeddings)
+            bge_embeddings = initialize_embeddings() 
+            # Load -> split -> embed -> upsert as one stream: peak memory is one batch, not the corpus.
+            text_chunks = split_documents_stream(iter_load_documents(KNOWLEDGE_DIR))
+            ingest_to_pinecone(text_chunks, bge_embeddings)
         except Exception as e:
             print(f"\nFATAL ERROR during ingestion. Check keys and logs.")
             print(f"Error details: {e}")
\ No newline at end of file
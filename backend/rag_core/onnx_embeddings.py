@@ -0,0 +1,90 @@
+import logging
+import os
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+QUANTIZED_FILE = "model_quantized.onnx"
+
+
+def l2_normalize(vectors) -> np.ndarray:
+    """Row-wise L2 normalization in float32: one reduction and one in-place scale."""
+    v = np.array(vectors, dtype=np.float32, ndmin=2)
+    v *= 1.0 / np.sqrt((v * v).sum(axis=-1, keepdims=True) + 1e-12)
+    return v
+
+
+def export_quantized(model_name: str, output_dir: str) -> None:
+    """
+    Exports a Hugging Face model to ONNX and applies dynamic INT8 quantization
+    (AVX-512 VNNI), writing the model and tokenizer to `output_dir`.
+    """
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    logger.info("Exporting %s to INT8 ONNX at: %s", model_name, output_dir)
+    model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+    quantizer = ORTQuantizer.from_pretrained(model)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=output_dir, quantization_config=qconfig)
+    AutoTokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+
+
+class OnnxBgeEmbeddings(Embeddings):
+    """
+    BGE sentence embeddings served by ONNX Runtime instead of PyTorch.
+
+    Loads an exported (and typically INT8-quantized) model directory. If the
+    directory does not exist yet and `model_name` is given, the model is
+    exported and quantized into it on first use. Manual equivalent:
+
+        optimum-cli export onnx --model BAAI/bge-small-en-v1.5 bge_onnx/
+        optimum-cli onnxruntime quantize --onnx_model bge_onnx --output bge_int8 --avx512_vnni
+
+    Output matches `HuggingFaceEmbeddings(encode_kwargs={"normalize_embeddings": True})`:
+    CLS pooling (as configured for BGE) followed by L2 normalization.
+    """
+
+    def __init__(self, model_dir: str, model_name: str = None,
+                 batch_size: int = 64, max_length: int = 512):
+        # Optional dependency: only needed when the ONNX path is enabled.
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        if not os.path.isdir(model_dir):
+            if not model_name:
+                raise FileNotFoundError(f"ONNX model directory not found: {model_dir}")
+            export_quantized(model_name, model_dir)
+
+        file_name = QUANTIZED_FILE if os.path.exists(os.path.join(model_dir, QUANTIZED_FILE)) else None
+
+        logger.info("Loading ONNX embedding model from: %s", model_dir)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name=file_name, provider="CPUExecutionProvider"
+        )
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenizer(
+            texts, padding=True, truncation=True,
+            max_length=self.max_length, return_tensors="np",
+        )
+        hidden = self.model(**inputs).last_hidden_state
+        return l2_normalize(hidden[:, 0])
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = [
+            self._encode(texts[i:i + self.batch_size])
+            for i in range(0, len(texts), self.batch_size)
+        ]
+        return np.concatenate(vectors).tolist() if vectors else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
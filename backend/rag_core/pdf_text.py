@@ -0,0 +1,17 @@
+import operator
+
+import pymupdf
+
+_page_text = operator.methodcaller("get_text", "text")
+
+
+def extract_pdf_text(data: bytes) -> str:
+    """
+    Extracts text from an in-memory PDF.
+
+    Kept apart from the web app so spawned pool workers import only PyMuPDF,
+    not FastAPI, LangChain and the embedding model.
+    """
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        # PyMuPDF always returns str, so no `or ""` fallback per page.
+        return "\n".join(map(_page_text, doc))
@@ -0,0 +1,240 @@
+import asyncio
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+from pydantic import PrivateAttr
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent async calls arriving within `window_ms` (or until
+    `max_batch` are pending) into one call of a sync batch function, run on
+    a worker thread. Each caller gets back its own element of the result.
+    """
+
+    def __init__(self, batch_fn: Callable[[list], list], max_batch: int = 32, window_ms: float = 10.0):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window = window_ms / 1000.0
+        self._pending: list = []
+        self._timer = None
+        self._tasks: set = set()  # strong refs so in-flight batches aren't GC'd
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((item, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list) -> None:
+        try:
+            results = await asyncio.to_thread(self.batch_fn, [item for item, _ in batch])
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+
+class CachedRetriever(BaseRetriever):
+    """
+    Vector-store retriever with an LRU + TTL cache in front of the remote index.
+
+    Lookups go through two layers before touching Pinecone:
+      1. exact: SHA1 of the int8-quantized query embedding;
+      2. semantic: cosine against recent query embeddings (float16 matrix),
+         reusing the hit's documents above `similarity_threshold`.
+    Concurrent misses for the same key are collapsed into one remote query.
+
+    On the async path, queries arriving within `batch_window_ms` are embedded
+    in one batched forward pass; their index queries then run concurrently
+    (Pinecone has no multi-vector query, so that is the widest batch available).
+    """
+
+    vectorstore: VectorStore
+    embeddings: Embeddings
+    k: int = 3
+    search_filter: Optional[dict] = None  # Pinecone metadata filter, e.g. {"source": {"$in": [...]}}
+    capacity: int = 512
+    ttl_seconds: float = 300.0
+    similarity_threshold: float = 0.95
+    batch_window_ms: float = 10.0
+    max_batch_size: int = 32
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _entries: Any = PrivateAttr(default_factory=OrderedDict)  # key -> (row, expires_at, docs)
+    _inflight: Any = PrivateAttr(default_factory=dict)        # key -> threading.Event
+    _matrix: Any = PrivateAttr(default=None)                  # (capacity, dim) float16
+    _row_keys: Any = PrivateAttr(default=None)
+    _free_rows: Any = PrivateAttr(default=None)
+    _embed_batcher: Any = PrivateAttr(default=None)
+
+    @staticmethod
+    def _key(vec: np.ndarray) -> bytes:
+        quantized = np.clip(np.rint(vec * 127.0), -127, 127).astype(np.int8)
+        return hashlib.sha1(quantized.tobytes()).digest()
+
+    def clear(self) -> None:
+        """Drops every cached result, e.g. after new documents were upserted."""
+        with self._lock:
+            self._entries = OrderedDict()
+            self._inflight = {}  # queries already in flight finish uncached
+            self._matrix = None
+            self._row_keys = None
+            self._free_rows = None
+
+    def _drop(self, key: bytes) -> None:
+        row, _, _ = self._entries.pop(key)
+        self._matrix[row] = 0
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _lookup(self, key: bytes, vec: np.ndarray):
+        """Returns cached documents or None. Caller holds `_lock`."""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                self._entries.move_to_end(key)
+                return entry[2]
+            self._drop(key)
+
+        if self._matrix is None or not self._entries:
+            return None
+
+        scores = self._matrix @ vec.astype(np.float16)
+        row = int(np.argmax(scores))
+        hit_key = self._row_keys[row]
+        if hit_key is None or scores[row] < self.similarity_threshold:
+            return None
+        _, expires_at, docs = self._entries[hit_key]
+        if expires_at <= now:
+            self._drop(hit_key)
+            return None
+        self._entries.move_to_end(hit_key)
+        return docs
+
+    def _store(self, key: bytes, vec: np.ndarray, docs: List[Document]) -> None:
+        """Caller holds `_lock`."""
+        if self._matrix is None:
+            self._matrix = np.zeros((self.capacity, vec.shape[0]), dtype=np.float16)
+            self._row_keys = [None] * self.capacity
+            self._free_rows = list(range(self.capacity - 1, -1, -1))
+        if key in self._entries:
+            self._drop(key)
+        if not self._free_rows:
+            self._drop(next(iter(self._entries)))  # evict least recently used
+
+        row = self._free_rows.pop()
+        self._matrix[row] = vec
+        self._row_keys[row] = key
+        self._entries[key] = (row, time.monotonic() + self.ttl_seconds, docs)
+
+    def _claim(self, key: bytes, vec: np.ndarray):
+        """
+        Returns `(docs, owned, waiting)`: cached docs on a hit; otherwise either
+        an event this caller now owns (it must query the index, then `_finish`)
+        or another caller's in-flight event to wait on.
+        """
+        with self._lock:
+            docs = self._lookup(key, vec)
+            if docs is not None:
+                return docs, None, None
+            pending = self._inflight.get(key)
+            if pending is None:
+                pending = self._inflight[key] = threading.Event()
+                return None, pending, None
+            return None, None, pending
+
+    def _finish(self, key: bytes, vec: np.ndarray, docs, owned: threading.Event) -> None:
+        with self._lock:
+            # After a `clear()` the claim is gone: the result may predate it.
+            if self._inflight.get(key) is owned:
+                del self._inflight[key]
+                if docs is not None:
+                    self._store(key, vec, docs)
+        owned.set()
+
+    def _search(self, vec: np.ndarray) -> List[Document]:
+        # Reuse the query vector instead of letting the store re-embed it.
+        return self.vectorstore.similarity_search_by_vector(vec.tolist(), k=self.k, filter=self.search_filter)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        vec = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        key = self._key(vec)
+
+        while True:
+            docs, owned, waiting = self._claim(key, vec)
+            if docs is not None:
+                return docs
+            if owned is not None:
+                break
+            # Another caller is already querying the index for this vector.
+            waiting.wait()
+
+        docs = None
+        try:
+            docs = self._search(vec)
+            return docs
+        finally:
+            self._finish(key, vec, docs, owned)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self._embed_batcher is None:
+            # Prefer a query-aware batch method (e.g. cache-backed) when offered.
+            batch_fn = getattr(self.embeddings, "embed_queries", self.embeddings.embed_documents)
+            self._embed_batcher = MicroBatcher(
+                batch_fn,
+                max_batch=self.max_batch_size,
+                window_ms=self.batch_window_ms,
+            )
+        vec = np.asarray(await self._embed_batcher.submit(query), dtype=np.float32)
+        key = self._key(vec)
+
+        while True:
+            docs, owned, waiting = self._claim(key, vec)
+            if docs is not None:
+                return docs
+            if owned is not None:
+                break
+            await asyncio.to_thread(waiting.wait)
+
+        docs = None
+        try:
+            docs = await asyncio.to_thread(self._search, vec)
+            return docs
+        finally:
+            self._finish(key, vec, docs, owned)
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_query(query: str) -> str:
+    """Lowercases and collapses whitespace so trivial variants share a key."""
+    return " ".join(query.lower().split())
+
+
+class SemanticCache:
+    """
+    Two-tier answer cache for the RAG chain, scoped per retrieval scope.
+
+    Tier 1 is an exact match on the normalized query. Tier 2 compares the
+    BGE query embedding against every cached query embedding in a single
+    matrix-vector product and accepts the best match above `threshold`.
+    Both tiers share one LRU order and one fixed-size embedding matrix.
+
+    Queries should be standalone (already rewritten against the chat
+    history), so a follow-up like "tell me more" never matches by itself.
+    The query is embedded verbatim, the same string the retriever embeds,
+    so a shared `CachedBgeEmbeddings` encodes it only once per turn.
+    Entries expire after `ttl_seconds`; `clear()` drops everything, e.g.
+    when new documents change what retrieval would return.
+    """
+
+    def __init__(self, embeddings: Embeddings, threshold: float = 0.92,
+                 capacity: int = 1024, dim: int = 384, ttl_seconds: float = 600.0):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl_seconds = ttl_seconds
+        self.dim = dim
+
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        """Caller holds `_lock` (or is `__init__`)."""
+        self._rows: "OrderedDict[Tuple[str, str], int]" = OrderedDict()  # key -> row, in LRU order
+        self._matrix = np.zeros((self.capacity, self.dim), dtype=np.float32)
+        self._scope_codes = np.full(self.capacity, -1, dtype=np.int32)
+        self._expires = np.zeros(self.capacity, dtype=np.float64)
+        self._answers: list = [None] * self.capacity
+        self._keys: list = [None] * self.capacity
+        self._scopes: dict = {}
+        self._free: list = []  # rows released by expired entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._reset()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def get(self, scope: str, query: str) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """
+        Returns `(answer, query_embedding)`. On a miss the answer is None and the
+        embedding is handed back so `put` does not need to encode the query again.
+        """
+        key = (scope, normalize_query(query))
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None:
+                if self._expires[row] > time.monotonic():
+                    self._rows.move_to_end(key)
+                    return self._answers[row], None
+                self._drop(key)
+
+        query_emb = self._embed(query)
+
+        with self._lock:
+            code = self._scopes.get(scope)
+            if code is None or not self._rows:
+                return None, query_emb
+
+            scores = self._matrix @ query_emb
+            stale = (self._scope_codes != code) | (self._expires <= time.monotonic())
+            scores[stale] = -1.0
+            row = int(np.argmax(scores))
+            if scores[row] < self.threshold:
+                return None, query_emb
+
+            self._rows.move_to_end(self._keys[row])
+            return self._answers[row], query_emb
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        """Frees an entry's row. Caller holds `_lock`."""
+        row = self._rows.pop(key)
+        self._free.append(row)
+        self._scope_codes[row] = -1
+        self._answers[row] = None
+        self._keys[row] = None
+
+    def put(self, scope: str, query: str, answer: str,
+            query_emb: Optional[np.ndarray] = None) -> None:
+        """Stores an answer, evicting the least recently used entry when full."""
+        if not answer.strip():
+            return
+
+        key = (scope, normalize_query(query))
+        if query_emb is None:
+            query_emb = self._embed(query)
+
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                if self._free:
+                    row = self._free.pop()
+                elif len(self._rows) < self.capacity:
+                    row = len(self._rows)
+                else:
+                    _, row = self._rows.popitem(last=False)
+
+            code = self._scopes.setdefault(scope, len(self._scopes))
+            self._matrix[row] = query_emb
+            self._scope_codes[row] = code
+            self._expires[row] = time.monotonic() + self.ttl_seconds
+            self._answers[row] = answer
+            self._keys[row] = key
+            self._rows[key] = row
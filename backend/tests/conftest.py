@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py imports `rag_core` relative to backend/, as it does under uvicorn.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,33 @@
+import time
+
+from langchain_core.language_models import FakeListLLM
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from rag_core.chat_pipeline import SummaryBufferHistory, _approx_token_ids
+
+SUMMARY_DELAY = 0.5
+
+
+class SlowSummaryLLM(FakeListLLM):
+    """Summarizer that takes a while, like a real Ollama call."""
+
+    def _call(self, *args, **kwargs):
+        time.sleep(SUMMARY_DELAY)
+        return super()._call(*args, **kwargs)
+
+
+def test_summarization_runs_after_the_turn_is_recorded():
+    llm = SlowSummaryLLM(responses=["The Boss asked about ML."], custom_get_token_ids=_approx_token_ids)
+    history = SummaryBufferHistory(llm, max_token_limit=30, max_messages=50)
+    turn = [HumanMessage(content="what is ml " * 10), AIMessage(content="Machine learning, Boss. " * 10)]
+
+    start = time.monotonic()
+    history.add_messages(turn)
+
+    assert time.monotonic() - start < SUMMARY_DELAY  # returns without waiting for the LLM
+    assert history.messages == turn  # nothing vanishes while the summary is pending
+
+    deadline = time.monotonic() + 5
+    while not isinstance(history.messages[0], SystemMessage) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert history.messages[0].content == "The Boss asked about ML."
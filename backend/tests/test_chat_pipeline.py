@@ -0,0 +1,68 @@
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListLLM
+from langchain_core.retrievers import BaseRetriever
+from pinecone.exceptions import PineconeConfigurationError
+
+import main
+from rag_core import chat_pipeline
+from rag_core.semantic_cache import SemanticCache
+
+QUESTION = "what is supervised learning"
+ANSWER = "Learning from labelled examples, Boss."
+
+
+class CountingRetriever(BaseRetriever):
+    """Stands in for the Pinecone retriever and counts index round trips."""
+
+    calls: int = 0
+
+    def _get_relevant_documents(self, query, *, run_manager):
+        self.calls += 1
+        return [Document(page_content="Supervised learning uses labelled data.")]
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    # Answer for the first turn, then the rewrite step's standalone question;
+    # a fourth call would mean the cache missed.
+    llm = FakeListLLM(
+        responses=[ANSWER, QUESTION, QUESTION, "cache miss"],
+        custom_get_token_ids=chat_pipeline._approx_token_ids,
+    )
+    retriever = CountingRetriever()
+    cache = SemanticCache(DeterministicFakeEmbedding(size=384))
+    monkeypatch.setattr(chat_pipeline, "_get_llm", lambda: llm)
+    monkeypatch.setattr(chat_pipeline, "_get_retriever", lambda sources=(): retriever)
+    monkeypatch.setattr(chat_pipeline, "get_semantic_cache", lambda: cache)
+    monkeypatch.setattr(main, "jarvis_chain", chat_pipeline.get_jarvis_chain())
+    yield llm, retriever
+    chat_pipeline.STORE.pop("repeat", None)
+
+
+def test_repeated_question_hits_the_semantic_cache(pipeline):
+    llm, retriever = pipeline
+    client = TestClient(main.app)
+
+    answers = [
+        client.post("/stream_chat_raw", json={"input": QUESTION, "session_id": "repeat"}).text
+        for _ in range(3)
+    ]
+
+    assert answers == [ANSWER] * 3
+    assert retriever.calls == 1  # later turns never reach the index
+    assert llm.i == 3  # one answer, then only the two rewrites
+
+
+def test_chain_fails_at_build_time_without_pinecone(monkeypatch):
+    monkeypatch.delenv("PINECONE_API_KEY", raising=False)
+    monkeypatch.setattr(chat_pipeline, "PINECONE_API_KEY", None)
+    chat_pipeline._get_pinecone.cache_clear()
+    chat_pipeline.get_vectorstore.cache_clear()
+    chat_pipeline._get_retriever.cache_clear()
+
+    # Raised at startup (main.py answers 503), not mid-stream after a 200.
+    with pytest.raises(PineconeConfigurationError):
+        chat_pipeline.get_jarvis_chain()
@@ -0,0 +1,33 @@
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from rag_core.retrieval_cache import CachedRetriever
+
+
+class CountingVectorStore(InMemoryVectorStore):
+    """In-memory stand-in for Pinecone that counts index queries."""
+
+    calls: int = 0
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        self.calls += 1
+        return super().similarity_search_by_vector(embedding, k=k)
+
+
+def test_clear_forgets_cached_results():
+    embeddings = DeterministicFakeEmbedding(size=8)
+    store = CountingVectorStore(embeddings)
+    store.add_documents([Document(page_content="old notes")])
+    retriever = CachedRetriever(vectorstore=store, embeddings=embeddings, k=2)
+
+    retriever.invoke("what is ml")
+    retriever.invoke("what is ml")
+    assert store.calls == 1
+
+    store.add_documents([Document(page_content="new notes")])
+    retriever.clear()
+
+    docs = retriever.invoke("what is ml")
+    assert store.calls == 2
+    assert {doc.page_content for doc in docs} == {"old notes", "new notes"}
@@ -0,0 +1,61 @@
+import zlib
+
+from rag_core.semantic_cache import SemanticCache
+
+
+class OneHotEmbeddings:
+    """Deterministic stand-in for BGE: each text maps to one of four axes."""
+
+    def embed_query(self, text):
+        vec = [0.0] * 4
+        vec[zlib.crc32(text.encode()) % 4] = 1.0
+        return vec
+
+
+def _cache(**kwargs):
+    return SemanticCache(OneHotEmbeddings(), capacity=4, dim=4, **kwargs)
+
+
+def test_answers_are_scoped_to_their_retrieval_scope():
+    cache = _cache()
+    cache.put("a.pdf", "what is ml", "answer from a.pdf")
+
+    assert cache.get("a.pdf", "What is  ML")[0] == "answer from a.pdf"
+    assert cache.get("b.pdf", "what is ml")[0] is None
+
+
+def test_query_is_embedded_verbatim():
+    embedded = []
+
+    class RecordingEmbeddings(OneHotEmbeddings):
+        def embed_query(self, text):
+            embedded.append(text)
+            return super().embed_query(text)
+
+    cache = SemanticCache(RecordingEmbeddings(), capacity=4, dim=4)
+    cache.get("", "What is ML?")
+
+    # Same string the retriever embeds, so the embedding cache serves it once.
+    assert embedded == ["What is ML?"]
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("rag_core.semantic_cache.time.monotonic", lambda: now[0])
+    cache = _cache(ttl_seconds=60)
+    cache.put("s", "what is ml", "Machine learning, Boss.")
+
+    now[0] += 61
+
+    assert cache.get("s", "what is ml")[0] is None
+
+
+def test_clear_drops_every_session():
+    cache = _cache()
+    cache.put("a", "what is ml", "answer a")
+    cache.put("b", "what is ml", "answer b")
+
+    cache.clear()
+
+    assert cache.get("a", "what is ml")[0] is None
+    assert cache.get("b", "what is ml")[0] is None
@@ -0,0 +1,57 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+TOKENS = ["Good evening", ", Boss.\nLine two"]
+
+
+class FakeChain:
+    """Stands in for the RAG chain: streams fixed tokens, no LLM or Pinecone."""
+
+    async def astream(self, input_data, config=None):
+        for token in TOKENS:
+            yield token
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "jarvis_chain", FakeChain())
+    # No `with`: skip the lifespan, which loads the real models.
+    return TestClient(main.app)
+
+
+def _sse_data(body: str) -> str:
+    """Joins the `data:` lines of every event, as frontend/renderer.js does."""
+    text = []
+    for event in body.split("\n\n"):
+        lines = [line[5:].removeprefix(" ") for line in event.split("\n") if line.startswith("data:")]
+        text.append("\n".join(lines))
+    return "".join(text)
+
+
+def test_stream_chat_sends_raw_tokens_as_sse(client):
+    response = client.post("/stream_chat", json={"input": "hello there jarvis", "session_id": "t"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert response.headers["x-accel-buffering"] == "no"
+    assert 'data: "' not in response.text  # tokens are not JSON-quoted
+    assert _sse_data(response.text) == "".join(TOKENS)
+
+
+def test_stream_chat_raw_sends_plain_text(client):
+    response = client.post("/stream_chat_raw", json={"input": "hello there jarvis", "session_id": "t"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.text == "".join(TOKENS)
+
+
+@pytest.mark.parametrize("path", ["/stream_chat", "/stream_chat_raw"])
+def test_stream_endpoints_report_missing_chain(client, monkeypatch, path):
+    monkeypatch.setattr(main, "jarvis_chain", None)
+
+    response = client.post(path, json={"input": "hi"})
+
+    assert response.status_code == 503
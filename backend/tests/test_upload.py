@@ -0,0 +1,78 @@
+import asyncio
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pymupdf
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.vectorstores import InMemoryVectorStore
+
+import main
+from rag_core.semantic_cache import SemanticCache
+
+
+def _pdf(text: str) -> bytes:
+    with pymupdf.open() as doc:
+        doc.new_page().insert_text((72, 72), text)
+        return doc.tobytes()
+
+
+def test_pdf_upload_works_across_lifespans(monkeypatch):
+    embeddings = DeterministicFakeEmbedding(size=384)
+    store = InMemoryVectorStore(embeddings)
+    monkeypatch.setattr(main, "WARMUP", False)
+    monkeypatch.setattr(main, "get_jarvis_chain", lambda: None)
+    monkeypatch.setattr(main, "get_embeddings", lambda: embeddings)
+    monkeypatch.setattr(main, "get_vectorstore", lambda: store)
+    monkeypatch.setattr(main, "get_semantic_cache", lambda: SemanticCache(embeddings))
+
+    # The PDF pool belongs to the lifespan, so a restarted app gets a fresh one.
+    for run in range(2):
+        with TestClient(main.app) as client:
+            response = client.post(
+                "/upload_doc",
+                files={"file": ("notes.pdf", _pdf(f"Jarvis notes {run}"), "application/pdf")},
+                data={"session_id": "t"},
+            )
+        assert response.json() == {"status": "success", "filename": "notes.pdf"}
+
+    assert {entry["text"] for entry in store.store.values()} == {"Jarvis notes 0", "Jarvis notes 1"}
+
+
+def test_cancelled_upload_is_joined_not_repeated(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+    upserts = []
+
+    def slow_extract(data):
+        started.set()
+        release.wait(5)
+        return data.decode()
+
+    monkeypatch.setitem(main._EXTRACTORS, ".txt", slow_extract)
+    monkeypatch.setattr(main, "invalidate_retrieval_cache", lambda: None)
+    monkeypatch.setattr(main, "get_semantic_cache", lambda: SimpleNamespace(clear=lambda: None))
+    state = SimpleNamespace(
+        vectorstore=SimpleNamespace(add_documents=upserts.append),
+        ingest_pool=ThreadPoolExecutor(max_workers=2),
+    )
+    request = SimpleNamespace(app=SimpleNamespace(state=state))
+
+    def upload():
+        return main.upload_doc(request, UploadFile(io.BytesIO(b"Jarvis notes"), filename="notes.txt"), "t")
+
+    async def scenario():
+        leader = asyncio.ensure_future(upload())
+        await asyncio.to_thread(started.wait, 5)
+        leader.cancel()  # client disconnected mid-ingestion
+        retry = asyncio.ensure_future(upload())
+        await asyncio.sleep(0.05)
+        release.set()
+        return await retry
+
+    # The retry waits for the still-running job and gets its real result.
+    assert asyncio.run(scenario()) == {"status": "success", "filename": "notes.txt"}
+    assert len(upserts) == 1
+    assert not main._inflight_uploads
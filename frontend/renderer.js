@@ -69,6 +69,18 @@ function clearChatHistory() {
   }
 }
 
+// === SSE Parsing ===
+// EventSource cannot POST, so /stream_chat frames are parsed off the fetch reader.
+function parseSSEData(event) {
+  const data = [];
+  for (const line of event.split("\n")) {
+    if (!line.startsWith("data:")) continue; // skip pings / comments / other fields
+    const value = line.slice(5);
+    data.push(value.startsWith(" ") ? value.slice(1) : value);
+  }
+  return data.join("\n");
+}
+
 // === Streaming Response Handler ===
 async function submitTextQuery(question) {
   const payload = { input: question.trim(), session_id: currentSessionId };
@@ -92,13 +104,19 @@ async function submitTextQuery(question) {
     jarvisMsg.innerHTML = `<strong>Jarvis:</strong> `;
     chatHistoryContainer.appendChild(jarvisMsg);
 
-    // Stream incoming text
+    // Stream incoming Server-Sent Events
+    let buffer = "";
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
 
-      const chunk = decoder.decode(value, { stream: true });
-      fullText += chunk;
+      buffer += decoder.decode(value, { stream: true });
+      const events = buffer.split("\n\n");
+      buffer = events.pop(); // keep the trailing partial event
+
+      for (const event of events) {
+        fullText += parseSSEData(event);
+      }
 
       // Render Markdown live
       const parsedHTML = marked.parse(fullText);